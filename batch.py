@@ -0,0 +1,127 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def compileRuns(bf):
+    # collapses runs of + - < > into (opcode, count) pairs and resolves each
+    # bracket to the index of its partner, so the lockstep loop dispatches
+    # once per run rather than once per character
+    code = []
+    stack = []
+    for opcode in bf:
+        if opcode in '+-<>':
+            if code and code[-1][0] == opcode:
+                code[-1][1] += 1
+            else:
+                code.append([opcode, 1])
+        elif opcode == '[':
+            stack.append(len(code))
+            code.append(['[', None])
+        elif opcode == ']':
+            if not stack:
+                raise Exception('Unmatched ] at instruction ' + str(len(code)))
+            start = stack.pop()
+            code[start][1] = len(code)
+            code.append([']', start])
+        elif opcode in '.,':
+            code.append([opcode, 1])
+        else:
+            raise Exception('Unrecognized opcode ' + opcode)
+
+    if stack:
+        raise Exception('Unmatched [ at instruction ' + str(stack[-1]))
+    return code
+
+
+class BatchInterpreter(object):
+    # runs one program over many tapes at once, one row per input case. All
+    # rows share an instruction pointer; a row that leaves a loop before the
+    # others is masked out until the whole group leaves it, then re-enabled.
+
+    def __init__(self, rows, size=30000):
+        if np is None:
+            raise Exception('BatchInterpreter requires numpy')
+
+        self.rows = rows
+        self.size = size
+        # int64 rather than uint8 so cells behave like BrainfuckInterpreter's
+        # unbounded ints for any value a compiled program produces
+        self.cells = np.zeros((rows, size), dtype=np.int64)
+        self.pointers = np.zeros(rows, dtype=np.int64)
+        self.steps = 0
+
+    def execute(self, bf, inputs=None):
+        # inputs is an optional sequence of one str/bytes per row read by ','
+        # (0 at end of input); returns each row's output as a str
+        if inputs is not None and len(inputs) != self.rows:
+            raise Exception('Expected {} inputs, got {}'.format(self.rows, len(inputs)))
+
+        code = compileRuns(bf)
+        cells = self.cells
+        pointers = self.pointers
+        outputs = [[] for _ in range(self.rows)]
+        input_pos = [0] * self.rows
+
+        mask = np.ones(self.rows, dtype=bool)
+        active = np.arange(self.rows)
+        mask_stack = []
+
+        i = 0
+        while i < len(code):
+            opcode, arg = code[i]
+
+            if opcode == '+':
+                cells[active, pointers[active]] += arg
+                self.steps += arg
+            elif opcode == '-':
+                cells[active, pointers[active]] -= arg
+                self.steps += arg
+            elif opcode == '>':
+                pointers[active] += arg
+                if len(active) and pointers[active].max() >= self.size:
+                    raise Exception('Pointer past end of tape at instruction ' + str(i))
+                self.steps += arg
+            elif opcode == '<':
+                pointers[active] -= arg
+                if len(active) and pointers[active].min() < 0:
+                    raise Exception('Negative pointer at instruction ' + str(i))
+                self.steps += arg
+            elif opcode == '[':
+                self.steps += 1
+                entering = mask & (cells[np.arange(self.rows), pointers] != 0)
+                if entering.any():
+                    mask_stack.append(mask)
+                    mask = entering
+                    active = np.flatnonzero(mask)
+                else:
+                    i = arg
+            elif opcode == ']':
+                self.steps += 1
+                looping = mask & (cells[np.arange(self.rows), pointers] != 0)
+                if looping.any():
+                    mask = looping
+                    active = np.flatnonzero(mask)
+                    i = arg
+                else:
+                    mask = mask_stack.pop()
+                    active = np.flatnonzero(mask)
+            elif opcode == '.':
+                self.steps += 1
+                for row, value in zip(active, cells[active, pointers[active]]):
+                    outputs[row].append(chr(value))
+            elif opcode == ',':
+                self.steps += 1
+                for row in active:
+                    data = inputs[row] if inputs is not None else ''
+                    if input_pos[row] < len(data):
+                        value = data[input_pos[row]]
+                        cells[row, pointers[row]] = ord(value) if type(value) is str else value
+                        input_pos[row] += 1
+                    else:
+                        cells[row, pointers[row]] = 0
+
+            i += 1
+
+        return [''.join(out) for out in outputs]
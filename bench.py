@@ -0,0 +1,311 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+from batch import BatchInterpreter, np
+from interp import BrainfuckInterpreter
+from neuron import compile_source
+from stats import CompileStats
+
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench')
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+
+# sizes of the generated straight-line programs, in assignments
+STRAIGHT_LINE_SIZES = [16, 128, 1024]
+
+# timings shorter than this are too noisy to flag as regressions
+MIN_SECONDS = 0.005
+
+# rows the batch engine runs in lockstep
+BATCH_ROWS = 64
+
+
+def generate_straight_line(n):
+    lines = ['static void straight_{}()'.format(n), '{', '    char a;', '    char b;']
+    for i in range(n):
+        lines.append("    {} = '\\x{}' {} '\\x{}';".format(
+            'a' if i % 2 == 0 else 'b', i % 10, '+' if i % 3 else '-', (i * 7) % 10))
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def load_corpus():
+    programs = {}
+    programs_dir = os.path.join(BENCH_DIR, 'programs')
+    for name in sorted(os.listdir(programs_dir)):
+        if name.endswith('.c'):
+            with open(os.path.join(programs_dir, name)) as f:
+                programs[name[:-2]] = f.read()
+    for n in STRAIGHT_LINE_SIZES:
+        programs['straight_{}'.format(n)] = generate_straight_line(n)
+
+    kernels = {}
+    kernels_dir = os.path.join(BENCH_DIR, 'kernels')
+    for name in sorted(os.listdir(kernels_dir)):
+        if name.endswith('.bf'):
+            with open(os.path.join(kernels_dir, name)) as f:
+                kernels[name[:-3]] = ''.join(c for c in f.read() if c in '<>+-[].,')
+    return programs, kernels
+
+
+def run_interp(bf):
+    interp = BrainfuckInterpreter()
+    interp.execute(bf)
+    return interp.steps
+
+
+def run_offsets(bf):
+    interp = BrainfuckInterpreter.sized_for(bf)
+    interp.execute_offsets(bf, patterns=())
+    return interp.steps
+
+
+def run_fused(bf):
+    # offsets plus the superinstructions in superinstructions.json
+    interp = BrainfuckInterpreter.sized_for(bf)
+    interp.execute_offsets(bf)
+    return interp.steps
+
+
+def check_fused(kernels):
+    # superinstructions must not change what a program does, only how fast:
+    # the fused run has to end in the same cells, pointer and step count as
+    # the unfused one
+    mismatches = []
+    for name, bf in kernels.items():
+        states = []
+        for patterns in (None, ()):
+            interp = BrainfuckInterpreter.sized_for(bf)
+            with contextlib.redirect_stdout(io.StringIO()):
+                interp.execute_offsets(bf, patterns)
+            states.append((interp.cells, interp.pointer, interp.steps))
+        if states[0] != states[1]:
+            mismatches.append('{}: fused run ended at pointer {} after {} steps, '
+                              'unfused at pointer {} after {} steps{}'.format(
+                                  name, states[0][1], states[0][2], states[1][1], states[1][2],
+                                  '' if states[0][0] == states[1][0] else ', with different cells'))
+    return mismatches
+
+
+def run_batch(bf):
+    interp = BatchInterpreter(BATCH_ROWS)
+    interp.execute(bf)
+    return interp.steps
+
+
+# each engine takes flat BF and returns its own step count. Engines count
+# steps differently (execute re-runs [ on every iteration, the offset engines
+# count a whole folded run by its width), so the counts are only kept to spot
+# changes in behaviour; throughput is measured against count_instructions.
+ENGINES = {
+    'interp': run_interp,
+    'offsets': run_offsets,
+    'fused': run_fused,
+}
+if np is not None:
+    ENGINES['batch'] = run_batch
+
+# how many copies of the program an engine runs at once
+ENGINE_ROWS = {'batch': BATCH_ROWS}
+
+
+def count_instructions(bf):
+    # the reference instruction count every engine's time is divided by: what
+    # BrainfuckInterpreter.execute counts for one run of the program
+    interp = BrainfuckInterpreter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        interp.execute(bf)
+    return interp.steps
+
+
+def bench_compile(source, repeat):
+    # keeps the fastest of several runs; a stage that raises ends the run and
+    # is reported as the failed stage. Memory tracing stays off, since it
+    # would dominate the times
+    best = None
+    for _ in range(repeat):
+        stats = CompileStats(trace_memory=False)
+        bf = None
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                bf, _ = compile_source(source, stats)
+        except Exception:
+            pass
+        if best is None or stats.total_seconds() < best[0].total_seconds():
+            best = (stats, bf)
+
+    stats, bf = best
+    failed = [s.name for s in stats.stages if s.failed]
+    return {
+        'stages': {s.name: s.seconds for s in stats.stages},
+        'total_seconds': stats.total_seconds(),
+        'source_chars': len(source),
+        'bf_chars': None if bf is None else len(bf),
+        'failed_stage': failed[0] if failed else None,
+    }
+
+
+def bench_engine(run, bf, instructions, repeat):
+    best = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            steps = run(bf)
+            seconds = time.perf_counter() - start
+        if best is None or seconds < best[1]:
+            best = (steps, seconds)
+
+    steps, seconds = best
+    return {
+        'steps': steps,
+        'instructions': instructions,
+        'seconds': seconds,
+        'instructions_per_second': instructions / seconds if seconds > 0 else None,
+    }
+
+
+def run_benchmarks(repeat=3, engines=None):
+    programs, kernels = load_corpus()
+    engines = engines or sorted(ENGINES)
+
+    results = {'compile': {}, 'run': {}}
+    for name, source in programs.items():
+        results['compile'][name] = bench_compile(source, repeat)
+
+    # compiled programs are run alongside the kernels once the compiler
+    # produces BF for them
+    runnable = dict(kernels)
+    for name, r in results['compile'].items():
+        if r['bf_chars'] is not None:
+            with contextlib.redirect_stdout(io.StringIO()):
+                runnable[name], _ = compile_source(programs[name])
+
+    instructions = {name: count_instructions(bf) for name, bf in runnable.items()}
+    for engine in engines:
+        results['run'][engine] = {}
+        rows = ENGINE_ROWS.get(engine, 1)
+        for name, bf in runnable.items():
+            results['run'][engine][name] = bench_engine(
+                ENGINES[engine], bf, instructions[name] * rows, repeat)
+    return results
+
+
+def compare(results, baseline, threshold):
+    # returns a list of human-readable regressions: times that grew, or
+    # throughputs that shrank, by more than the threshold fraction
+    regressions = []
+
+    def check(label, new, old, higher_is_better=False):
+        if new is None or old is None or old == 0:
+            return
+        if not higher_is_better and max(new, old) < MIN_SECONDS:
+            return
+        change = (old - new) / old if higher_is_better else (new - old) / old
+        if change > threshold:
+            regressions.append('{}: {:.4g} -> {:.4g} ({:+.0%})'.format(
+                label, old, new, change if not higher_is_better else -change))
+
+    for name, r in results['compile'].items():
+        old = baseline.get('compile', {}).get(name)
+        if old is None:
+            continue
+        check('compile {} total seconds'.format(name), r['total_seconds'], old['total_seconds'])
+        for stage, seconds in r['stages'].items():
+            check('compile {} {} seconds'.format(name, stage), seconds, old['stages'].get(stage))
+        # generated code size is deterministic, so any growth is a regression
+        if r['bf_chars'] is not None and old['bf_chars'] is not None \
+        and r['bf_chars'] > old['bf_chars']:
+            regressions.append('compile {} bf chars: {} -> {}'.format(
+                name, old['bf_chars'], r['bf_chars']))
+        if old['failed_stage'] is None and r['failed_stage'] is not None:
+            regressions.append('compile {} now fails at {}'.format(name, r['failed_stage']))
+
+    for engine, runs in results['run'].items():
+        for name, r in runs.items():
+            old = baseline.get('run', {}).get(engine, {}).get(name)
+            if old is None:
+                continue
+            # step counts are deterministic, so a change means the engine now
+            # runs the program differently
+            if r['steps'] != old['steps']:
+                regressions.append('run {} {} steps: {} -> {}'.format(
+                    engine, name, old['steps'], r['steps']))
+            if max(r['seconds'], old['seconds']) < MIN_SECONDS:
+                continue
+            check('run {} {} instructions/s'.format(engine, name),
+                  r['instructions_per_second'], old.get('instructions_per_second'),
+                  higher_is_better=True)
+    return regressions
+
+
+def format_results(results):
+    lines = ['{:<16} {:>10} {:>10} {:>10}  {}'.format(
+        'program', 'compile ms', 'src chars', 'bf chars', 'failed stage')]
+    for name, r in results['compile'].items():
+        lines.append('{:<16} {:>10.3f} {:>10} {:>10}  {}'.format(
+            name, r['total_seconds'] * 1000, r['source_chars'],
+            '-' if r['bf_chars'] is None else r['bf_chars'], r['failed_stage'] or ''))
+
+    lines.append('')
+    lines.append('{:<10} {:<16} {:>10} {:>12} {:>10} {:>14}'.format(
+        'engine', 'program', 'steps', 'instructions', 'ms', 'instructions/s'))
+    for engine, runs in results['run'].items():
+        for name, r in runs.items():
+            lines.append('{:<10} {:<16} {:>10} {:>12} {:>10.3f} {:>14.0f}'.format(
+                engine, name, r['steps'], r['instructions'], r['seconds'] * 1000,
+                r['instructions_per_second'] or 0))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Run the compiler and interpreter benchmarks.')
+    arg_parser.add_argument('--repeat', type=int, default=3,
+                            help='runs per measurement; the fastest is kept')
+    arg_parser.add_argument('--engine', action='append', choices=sorted(ENGINES),
+                            help='engine to benchmark (repeatable, defaults to all)')
+    arg_parser.add_argument('--baseline', default=BASELINE_PATH)
+    arg_parser.add_argument('--save', action='store_true',
+                            help='store the results as the new baseline')
+    arg_parser.add_argument('--threshold', type=float, default=0.25,
+                            help='fractional slowdown that counts as a regression')
+    arg_parser.add_argument('--json', action='store_true',
+                            help='print the raw results as JSON')
+    args = arg_parser.parse_args(argv)
+
+    mismatches = check_fused(load_corpus()[1])
+    if mismatches:
+        print('superinstructions change the result:', file=sys.stderr)
+        for m in mismatches:
+            print('  ' + m, file=sys.stderr)
+        return 1
+
+    results = run_benchmarks(args.repeat, args.engine)
+    print(json.dumps(results, indent=2) if args.json else format_results(results))
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print('\nregressions over {:.0%}:'.format(args.threshold), file=sys.stderr)
+        for r in regressions:
+            print('  ' + r, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,10 @@
+static void arith()
+{
+    char a;
+    char b;
+    char c;
+    a = '\x5' + '\x3';
+    b = '\x9' - '\x2';
+    c = '\x1' + '\x2' + '\x3' - '\x4';
+    a = 'A' - '\x1';
+}
@@ -0,0 +1,21 @@
+static void nested_if()
+{
+    char x;
+    char y;
+    if ('\x1') {
+        x = '\x5';
+        if ('\x2') {
+            y = '\x3' + '\x4';
+            if ('\x0') {
+                x = '\x1';
+            } else {
+                x = '\x2';
+            }
+        } else {
+            y = '\x6';
+        }
+    } else {
+        x = '\x7';
+        y = '\x8' - '\x1';
+    }
+}
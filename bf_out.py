@@ -1,3 +1,6 @@
+from instr import Instr, Opcode
+
+
 class BrainfuckSource(object):
     
     def __init__(self, bil, bf):
@@ -27,43 +30,49 @@ class BrainfuckSource(object):
             if type(self.bf[0]) is str:
                 print('%s : %s' % (self.bf[0], str(self.bil)))
 
-    def flattened(self):
-        flat = ''
+    def iterFlattened(self):
         for child in self.bf:
             if type(child) is str:
-                flat += child
+                yield child
             else:
-                flat += child.flattened()
-        return flat
+                yield from child.iterFlattened()
+
+    def flattened(self):
+        return ''.join(self.iterFlattened())
+
+
+def iterFlattened(sources):
+    for source in sources:
+        yield from source.iterFlattened()
 
 
 class BrainfuckVisitor(object):
 
     def visit(self, c):
-        if c[0] == 'go':
-            result = self.visitGo(dst=c[1])
-        elif c[0] == 'add':
-            result = self.visitAdd(dst=c[1], count=c[2])
-        elif c[0] == 'cond':
-            result = self.visitCond(src=c[1], op=c[2])
-        elif c[0] == 'move':
-            result = self.visitMove(dst=c[1], src=c[2])
-        elif c[0] == 'unmove':
-            result = self.visitUnmove(c)
-        elif c[0] == 'zero':
-            result = self.visitZero(c[1])
-        elif c[0] == 'copy':
-            result = self.visitCopy(dst=c[1], src=c[2], work=c[3])
-        elif c[0] == 'iszero':
-            result = self.visitIsZero(c[1], c[2])
-        elif c[0] == 'isnotzero':
-            result = self.visitIsZero(c[1], c[2], negated=True)
-        elif c[0] == 'iseq':
+        if c.opcode == Opcode.GO:
+            result = self.visitGo(dst=c.args[0])
+        elif c.opcode == Opcode.ADD:
+            result = self.visitAdd(dst=c.args[0], count=c.args[1])
+        elif c.opcode == Opcode.COND:
+            result = self.visitCond(src=c.args[0], op=c.args[1])
+        elif c.opcode == Opcode.MOVE:
+            result = self.visitMove(dst=c.args[0], src=c.args[1])
+        elif c.opcode == Opcode.UNMOVE:
+            result = self.visitUnmove(dst=c.args[0], src=c.args[1])
+        elif c.opcode == Opcode.ZERO:
+            result = self.visitZero(c.args[0])
+        elif c.opcode == Opcode.COPY:
+            result = self.visitCopy(dst=c.args[0], src=c.args[1], work=c.args[2])
+        elif c.opcode == Opcode.ISZERO:
+            result = self.visitIsZero(c.args[0], c.args[1])
+        elif c.opcode == Opcode.ISNOTZERO:
+            result = self.visitIsZero(c.args[0], c.args[1], negated=True)
+        elif c.opcode == Opcode.ISEQ:
             result = self.visitIsEq(c)
-        elif c[0] == 'and':
-            result = self.visitAnd(c[1], c[2], c[3])
+        elif c.opcode == Opcode.AND:
+            result = self.visitAnd(c.args[0], c.args[1], c.args[2])
         else:
-            raise Exception('Unrecognized BIL opcode ' + c[0])
+            raise Exception('Unrecognized BIL opcode ' + str(c.opcode))
 
         return BrainfuckSource(c, result)
 
@@ -77,12 +86,12 @@ class BrainfuckVisitor(object):
         if len(src_list) == 0:
             raise Exception('Opcode \'and\' must have at least one src cell')
 
-        code = [self.visit(('add', work, len(src_list)))]
+        code = [self.visit(Instr(Opcode.ADD, work, len(src_list)))]
 
         for src in src_list:
-            code += [self.visit(('cond', src, ('add', work - src, -1)))]
+            code += [self.visit(Instr(Opcode.COND, src, Instr(Opcode.ADD, work - src, -1)))]
 
-        code += [self.visit(('iszero', dst, work))]
+        code += [self.visit(Instr(Opcode.ISZERO, dst, work))]
         return code
 
     def visitOr(self, dst, src_list):
@@ -91,7 +100,7 @@ class BrainfuckVisitor(object):
 
         code = []
         for src in src_list:
-            code += [self.visit(('cond', src, ('add', dst - src, 1)))]
+            code += [self.visit(Instr(Opcode.COND, src, Instr(Opcode.ADD, dst - src, 1)))]
         return code
 
     def visitXor(self, dst, src_list, work):
@@ -100,50 +109,50 @@ class BrainfuckVisitor(object):
 
         code = []
         for src in src_list:
-            code += [self.visit(('cond', src, ('add', dst - src, 1)))]
+            code += [self.visit(Instr(Opcode.COND, src, Instr(Opcode.ADD, dst - src, 1)))]
 
-        code += [self.visit(('copy', work[0], dst, work[1]))]
-        code += [self.visit(('iszero', work[0], work[1]))]
+        code += [self.visit(Instr(Opcode.COPY, work[0], dst, work[1]))]
+        code += [self.visit(Instr(Opcode.ISZERO, work[0], work[1]))]
         #code += [self.visit((
         return code
 
     def visitIsZero(self, dst, src, negated=False):
         code = []
         if not negated:
-            code += [self.visit(('add', dst, 1))]
+            code += [self.visit(Instr(Opcode.ADD, dst, 1))]
 
-        code += [self.visit(('cond', src, ('add', dst - src, 1 if negated else -1)))]
+        code += [self.visit(Instr(Opcode.COND, src, Instr(Opcode.ADD, dst - src, 1 if negated else -1)))]
         return code
 
     def visitAdd(self, dst, count):
-        return [self.visit(('go', dst))] + [('-' if count < 0 else '+') * abs(count)] + [self.visit(('go', dst * -1))]
+        return [self.visit(Instr(Opcode.GO, dst))] + [('-' if count < 0 else '+') * abs(count)] + [self.visit(Instr(Opcode.GO, dst * -1))]
 
     def visitCond(self, src, op):
-        code = [self.visit(('go', src))]
+        code = [self.visit(Instr(Opcode.GO, src))]
         code += ['[']
         code += [self.visit(op)]
-        code += [self.visit(('zero', 0))]
+        code += [self.visit(Instr(Opcode.ZERO, 0))]
         code += [']']
-        code += [self.visit(('go', src * -1))]
+        code += [self.visit(Instr(Opcode.GO, src * -1))]
         return code
 
     def visitBranch(self, src, work, true_ops, false_ops):
-        code = [self.visit(('go', src))]
+        code = [self.visit(Instr(Opcode.GO, src))]
         code += ['[']
         code += [self.visit(op) for op in true_ops]
-        code += [self.visit(('add', work, 1))]
-        code += [self.visit(('zero', 0))]
+        code += [self.visit(Instr(Opcode.ADD, work, 1))]
+        code += [self.visit(Instr(Opcode.ZERO, 0))]
         code += [']']
-        #code += [self.visit(('cond', work, false_op))]
+        #code += [self.visit(Instr(Opcode.COND, work, false_op))]
     
     def generateMove(self, op, dst, src):
-        code = [self.visit(('go', src))]
+        code = [self.visit(Instr(Opcode.GO, src))]
         code += ['[-']
-        code += [self.visit(('go', dst - src))]
+        code += [self.visit(Instr(Opcode.GO, dst - src))]
         code += [op]
-        code += [self.visit(('go', src - dst))]
+        code += [self.visit(Instr(Opcode.GO, src - dst))]
         code += [']']
-        code += [self.visit(('go', src * -1))]
+        code += [self.visit(Instr(Opcode.GO, src * -1))]
         return code
 
     def visitMove(self, dst, src):
@@ -153,32 +162,33 @@ class BrainfuckVisitor(object):
         return self.generateMove('-', dst, src)
 
     def visitZero(self, dst):
-        return [self.visit(('go', dst))] + ['[-]'] + [self.visit(('go', dst * -1))]
+        return [self.visit(Instr(Opcode.GO, dst))] + ['[-]'] + [self.visit(Instr(Opcode.GO, dst * -1))]
 
     def visitCopy(self, dst, src, work):
-        code = [self.visit(('go', src))]
+        code = [self.visit(Instr(Opcode.GO, src))]
         code += ['[-']
-        code += [self.visit(('go', work - src))]
+        code += [self.visit(Instr(Opcode.GO, work - src))]
         code += ['+']
-        code += [self.visit(('go', dst - work))]
+        code += [self.visit(Instr(Opcode.GO, dst - work))]
         code += ['+']
-        code += [self.visit(('go', src - dst))]
+        code += [self.visit(Instr(Opcode.GO, src - dst))]
         code += [']']
 
-        code += [self.visit(('move', 0, work - src))]
-        code += [self.visit(('go', src * -1))]
+        code += [self.visit(Instr(Opcode.MOVE, 0, work - src))]
+        code += [self.visit(Instr(Opcode.GO, src * -1))]
         return code
 
     def visitIsEq(self, dst, first, second, work):
-        code += [self.visit(('go', work[0]))]
+        code += [self.visit(Instr(Opcode.GO, work[0]))]
         code += ['+[']
-        code += [self.visit(('copy', work_a - first, second - first, work_b))]
-        code += [self.visit(('isnotzero', work_b, work_a - first))]
+        code += [self.visit(Instr(Opcode.COPY, work_a - first, second - first, work_b))]
+        code += [self.visit(Instr(Opcode.ISNOTZERO, work_b, work_a - first))]
         code += [']']
         return code
 
-    def visitBIL(self, bil):
-        bf = []
+    def iterBIL(self, bil):
         for c in bil:
-            bf.append(self.visit(c))
-        return bf
\ No newline at end of file
+            yield self.visit(c)
+
+    def visitBIL(self, bil):
+        return list(self.iterBIL(bil))
\ No newline at end of file
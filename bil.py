@@ -1,8 +1,12 @@
+from instr import Instr, Opcode
+
+
 class BILVisitor(object):
 
-    def __init__(self):
+    def __init__(self, debug=False):
         self.stack = {}
         self.stack_depth = 0
+        self.debug = debug
 
     def visitProgram(self, program):
         label_nums = {}
@@ -14,73 +18,73 @@ class BILVisitor(object):
                 label_nums[label] = last_label_num
 
         #code = [('add', 0, 1), ('while'), ('add', 0, -1)]
-        code = []
-        for label in program.blocks:
-            code.extend(self.visitBytecode(program.blocks[label].instrs))
-        return code
+        return list(self.iterBlocks(program.blocks.items()))
+
+    def iterBlocks(self, blocks):
+        # blocks is any iterable of (label, BasicBlock) pairs, e.g. the
+        # generator returned by cast.iterBasicBlocks
+        for label, block in blocks:
+            yield from self.iterBytecode(block.instrs)
 
     def visit(self, c):
-        print('visiting', c[0], 'stack:', self.stack)
-        if c[0] == 'reserve':
+        if self.debug:
+            print('visiting', c.opcode, 'stack:', self.stack)
+        if c.opcode == Opcode.RESERVE:
             return self.visitReserve(c)
-        elif c[0] == 'unreserve':
+        elif c.opcode == Opcode.UNRESERVE:
             return self.visitUnreserve(c)
-        elif c[0] == 'pop':
+        elif c.opcode == Opcode.POP:
             return self.visitPop(c)
-        elif c[0] == 'push':
+        elif c.opcode == Opcode.PUSH:
             return self.visitPush(c)
-        elif c[0] == 'addc':
+        elif c.opcode == Opcode.ADDC:
             return self.visitAddC(c)
-        elif c[0] == 'subc':
+        elif c.opcode == Opcode.SUBC:
             return self.visitSubC(c)
         else:
             return [c]
 
     def visitReserve(self, c):
         # stack layout: [block number] [reserved variables] [workspace]
-        self.stack[c[1]] = self.stack_depth
-        self.stack_depth += c[2]
-        return [('go', c[2])]
+        self.stack[c.args[0]] = self.stack_depth
+        self.stack_depth += c.args[1]
+        return [Instr(Opcode.GO, c.args[1])]
 
     def visitUnreserve(self, c):
-        self.stack_depth -= c[2]
-        del self.stack[c[1]]
-        return [('go', c[2] * -1)]
+        self.stack_depth -= c.args[1]
+        del self.stack[c.args[0]]
+        return [Instr(Opcode.GO, c.args[1] * -1)]
 
     def visitPop(self, c):
         # move the value at the top of the stack to the destination specified
         # by the argument, which will be a reserved location lower in the stack
-        print('stack:', self.stack)
-        bc = [('left', 1), ('move', self.stack[c[1]] - self.stack_depth + 1, 0)]
+        if self.debug:
+            print('stack:', self.stack)
+        bc = [Instr(Opcode.LEFT, 1), Instr(Opcode.MOVE, self.stack[c.args[0]] - self.stack_depth + 1, 0)]
         self.stack_depth -= 1
         return bc
 
     def visitPush(self, c):
-        # if the first argument is numeric
-        if c[1][0].isdigit() or c[1][0] == '-':
-            # if it's a char-sized constant
-            if c[1][-1] == 'c':
-                self.stack_depth += 1
-                return [('plus', 0, int(c[1][0:-1])), ('go', 1)]
-            else:
-                raise Exception('Unsupported constant ' + c[1])
-        else:
-            raise Exception('Unsupported push operand ' + c[1])
+        # the operand is a char-sized constant, already parsed to an int by
+        # CASTVisitor
+        self.stack_depth += 1
+        return [Instr(Opcode.PLUS, 0, c.args[0]), Instr(Opcode.GO, 1)]
 
     def visitAddC(self, c):
         # add the value at the top of the stack to the value at the location
         # immediately lower in the stack
         self.stack_depth -= 1
-        return [('move', -2, -1)]
+        return [Instr(Opcode.MOVE, -2, -1)]
 
     def visitSubC(self, c):
         # subtract the value at the top of the stack from the value at the
         # location immediately lower in the stack
         self.stack_depth -= 1
-        return [('unmove', -2, -1)]
+        return [Instr(Opcode.UNMOVE, -2, -1)]
 
-    def visitBytecode(self, code):
-        bil = []
+    def iterBytecode(self, code):
         for c in code:
-            bil.extend(self.visit(c))
-        return bil
\ No newline at end of file
+            yield from self.visit(c)
+
+    def visitBytecode(self, code):
+        return list(self.iterBytecode(code))
\ No newline at end of file
@@ -1,5 +1,6 @@
 from itertools import chain
 from pycparser.c_ast import FuncDef, ArrayDecl, Decl, While, Compound, Assignment, Constant, BinaryOp, If
+from instr import Instr, Opcode
 import re
 
 class Stack(object):
@@ -74,8 +75,9 @@ class CASTVisitor(object):
 
     stackVisitor = StackVisitor()
 
-    def __init__(self):
+    def __init__(self, debug=False):
         self.unique_counter = 0
+        self.debug = debug
 
     def get_unique(self, base):
         unique = base + '_' + str(self.unique_counter)
@@ -103,7 +105,7 @@ class CASTVisitor(object):
 
     def visitAssignment(self, f):
         code = self.visit(f.rvalue)
-        code.append(('pop', f.lvalue.name))
+        code.append(Instr(Opcode.POP, f.lvalue.name))
         return code
 
     def visitBinaryOp(self, f):
@@ -111,9 +113,9 @@ class CASTVisitor(object):
         code.extend(self.visit(f.left))
         code.extend(self.visit(f.right))
         if f.op == '+':
-            code.append(('addc',))
+            code.append(Instr(Opcode.ADDC))
         elif f.op == '-':
-            code.append(('subc',))
+            code.append(Instr(Opcode.SUBC))
         else:
             raise Exception('Unsupported operator "' + f.op + '"')
         return code
@@ -138,14 +140,14 @@ class CASTVisitor(object):
 
     def visitConstant(self, f):
         if f.type == 'char':
-            return [('push', '{}c'.format(self.parseCharConstant(f.value)))]
+            return [Instr(Opcode.PUSH, self.parseCharConstant(f.value))]
         else:
             raise Exception('Unsupported constant type ' + f.type)
 
     def visitDecl(self, f):
         if f.init is not None:
             code = self.visit(f.init)
-            code.append(('pop', f.name))
+            code.append(Instr(Opcode.POP, f.name))
             return code
         else:
             return []
@@ -157,66 +159,76 @@ class CASTVisitor(object):
         done_label = self.get_unique('if_done')
 
         code = self.visit(f.cond)
-        code.append(('cond', true_label, false_label))
+        code.append(Instr(Opcode.COND, true_label, false_label))
 
-        code.append(('label', true_label))
+        code.append(Instr(Opcode.LABEL, true_label))
         code.extend(true_block)
-        code.append(('jump', done_label))
+        code.append(Instr(Opcode.JUMP, done_label))
 
-        code.append(('label', false_label))
+        code.append(Instr(Opcode.LABEL, false_label))
         if f.iffalse is not None:
             false_block = self.visit(f.iffalse)
             code.extend(false_block)
 
-        code.append(('label', done_label))
+        code.append(Instr(Opcode.LABEL, done_label))
         return code
 
     def visitMain(self, f):
         code = []
         stack = CASTVisitor.stackVisitor.visitFuncDef(f)
-        print('stack: ' + str(stack))
+        if self.debug:
+            print('stack: ' + str(stack))
 
         for name in stack.names():
             size = stack.size(name)
-            code.append(('reserve', name, size))
+            code.append(Instr(Opcode.RESERVE, name, size))
 
         code.extend(self.visit(f.body))
 
         for name in stack.names():
             size = stack.size(name)
-            code.append(('unreserve', name, size))
+            code.append(Instr(Opcode.UNRESERVE, name, size))
 
         return code
 
 
-def addLabels(bytecode):
+def iterLabels(bytecode):
     label_num = 0
+    prev = None
+
+    for bc in bytecode:
+        if bc.opcode != Opcode.LABEL:
+            if prev is None or prev.opcode == Opcode.COND \
+            or prev.opcode == Opcode.JUMP:
+                yield Instr(Opcode.LABEL, 'lbl_' + str(label_num))
+                label_num += 1
+        yield bc
+        prev = bc
+
 
-    def make_label():
-        nonlocal label_num
-        lbl = 'lbl_' + str(label_num)
-        label_num += 1
-        return ('label', lbl)
+def addLabels(bytecode):
+    return list(iterLabels(bytecode))
 
-    labeled_code = []
-    for i in range(len(bytecode)):
-        if bytecode[i][0] is not 'label':
-            if i is 0 \
-            or bytecode[i - 1][0] is 'cond' \
-            or bytecode[i - 1][0] is 'jump':
-                labeled_code.append(make_label())
-        labeled_code.append(bytecode[i])
-    return labeled_code
+
+def iterJumps(bytecode):
+    # one instruction of lookahead is enough to know whether a fallthrough
+    # into the next label needs an explicit jump
+    prev = None
+
+    for bc in bytecode:
+        if prev is not None:
+            yield prev
+            if bc.opcode == Opcode.LABEL and prev.opcode != Opcode.COND \
+            and prev.opcode != Opcode.JUMP:
+                yield Instr(Opcode.JUMP, bc.args[0])
+        prev = bc
+
+    if prev is not None:
+        yield prev
 
 
 def addJumps(bytecode):
-    jump_code = []
-    for i in range(len(bytecode)):
-        jump_code.append(bytecode[i])
-        if i < len(bytecode)-1 and bytecode[i+1][0] is 'label':
-            if bytecode[i][0] is not 'cond' and bytecode[i][0] is not 'jump':
-                jump_code.append(('jump', bytecode[i+1][1]))
-    return jump_code
+    return list(iterJumps(bytecode))
 
 
 class BasicBlock(object):
@@ -239,24 +251,95 @@ class Program(object):
         return 'Program(main=\'{}\', blocks={})'.format(self.main, self.blocks)
 
 
-def getBasicBlocks(bytecode):
-    blocks = {}
+def iterBasicBlocks(bytecode):
+    # yields (label, block) pairs as soon as each block is complete, so only
+    # one block is held at a time
+    label = None
     current_block = None
 
     for bc in bytecode:
-        if bc[0] == 'label':
+        if bc.opcode == Opcode.LABEL:
+            if current_block is not None:
+                yield label, current_block
+            label = bc.args[0]
             current_block = BasicBlock()
-            blocks[bc[1]] = current_block
-        elif bc[0] == 'jump':
-            current_block.true_exit = bc[1]
-        elif bc[0] == 'cond':
-            current_block.true_exit = bc[1]
-            current_block.false_exit = bc[2]
+        elif bc.opcode == Opcode.JUMP:
+            current_block.true_exit = bc.args[0]
+        elif bc.opcode == Opcode.COND:
+            current_block.true_exit = bc.args[0]
+            current_block.false_exit = bc.args[1]
         current_block.instrs.append(bc)
-    return blocks
+
+    if current_block is not None:
+        yield label, current_block
+
+
+def getBasicBlocks(bytecode):
+    return dict(iterBasicBlocks(bytecode))
 
 
 def getProgram(bytecode):
-    main = bytecode[0][1]
+    main = bytecode[0].args[0]
     blocks = getBasicBlocks(bytecode)
-    return Program(main, blocks)
\ No newline at end of file
+    return Program(main, blocks)
+
+
+def valueNumberBlock(block):
+    # tracks the value each stack slot will hold at run time and replaces an
+    # addc/subc whose operands are both known with a single push of the
+    # result, dropping the pushes that fed it. Every expression CASTVisitor
+    # accepts is built from constants, so repeated expressions are computed
+    # once here rather than by a move/unmove loop each time they appear.
+    # Returns the number of move/unmove loops saved.
+    code = []
+    # (value or None if unknown, index in code where the value's pushes begin)
+    stack = []
+    saved = 0
+
+    for bc in block.instrs:
+        if bc.opcode == Opcode.PUSH:
+            stack.append((bc.args[0], len(code)))
+            code.append(bc)
+        elif bc.opcode == Opcode.ADDC or bc.opcode == Opcode.SUBC:
+            if len(stack) < 2:
+                stack = []
+                code.append(bc)
+                continue
+            right, _ = stack.pop()
+            left, start = stack.pop()
+            if left is not None and right is not None:
+                value = left + right if bc.opcode == Opcode.ADDC else left - right
+                del code[start:]
+                code.append(Instr(Opcode.PUSH, value))
+                saved += 1
+            else:
+                value = None
+                code.append(bc)
+            stack.append((value, start))
+        elif bc.opcode == Opcode.POP or bc.opcode == Opcode.COND:
+            if stack:
+                stack.pop()
+            code.append(bc)
+        else:
+            # anything else (reserve, unreserve, ...) may move the stack, so
+            # forget what it held rather than fold across it
+            stack = []
+            code.append(bc)
+
+    block.instrs = code
+    return saved
+
+
+def valueNumberProgram(program):
+    saved = 0
+    for label in program.blocks:
+        saved += valueNumberBlock(program.blocks[label])
+    return saved
+
+
+def iterValueNumbered(blocks):
+    # lazy counterpart of valueNumberProgram over (label, block) pairs, e.g.
+    # from iterBasicBlocks; each block is numbered on its own anyway
+    for label, block in blocks:
+        valueNumberBlock(block)
+        yield label, block
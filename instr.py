@@ -0,0 +1,56 @@
+from enum import IntEnum
+
+
+class Opcode(IntEnum):
+    # bytecode, emitted by CASTVisitor
+    LABEL = 0
+    JUMP = 1
+    COND = 2
+    RESERVE = 3
+    UNRESERVE = 4
+    PUSH = 5
+    POP = 6
+    ADDC = 7
+    SUBC = 8
+
+    # BIL, emitted by BILVisitor and consumed by BrainfuckVisitor; 'cond' is
+    # shared with the bytecode above
+    GO = 9
+    ADD = 10
+    PLUS = 11
+    LEFT = 12
+    MOVE = 13
+    UNMOVE = 14
+    ZERO = 15
+    COPY = 16
+    ISZERO = 17
+    ISNOTZERO = 18
+    ISEQ = 19
+    AND = 20
+
+    def __str__(self):
+        return self.name.lower()
+
+
+class Instr(object):
+    # operands are stored already parsed (e.g. the value of a 'push' is an
+    # int, not the '5c' string it used to be), so passes never re-parse them
+    __slots__ = ('opcode', 'args')
+
+    def __init__(self, opcode, *args):
+        self.opcode = opcode
+        self.args = args
+
+    def __eq__(self, other):
+        return type(other) is Instr \
+            and self.opcode == other.opcode and self.args == other.args
+
+    def __hash__(self):
+        return hash((self.opcode, self.args))
+
+    def __repr__(self):
+        return 'Instr({})'.format(', '.join(
+            ['Opcode.' + self.opcode.name] + [repr(a) for a in self.args]))
+
+    def __str__(self):
+        return ' '.join([str(self.opcode)] + [str(a) for a in self.args])
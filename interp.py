@@ -1,17 +1,165 @@
+from array import array
+import hashlib
+import os
+import struct
 import sys
+import time
+
+from offsets import CLOSE, FUSED, INPUT, OPEN, OUTPUT, UPDATE, compileOffsets, tapeBounds
+import superinstructions
+
+
+def program_hash(bf):
+    return hashlib.sha256(bf.encode('ascii')).digest()
+
+
+class Snapshot(object):
+    # header: magic, version, program hash, tape size, ip, pointer, steps,
+    # farthest_nonzero, loop stack depth, cell encoding, stored cell count
+    MAGIC = b'BFSN'
+    VERSION = 1
+    HEADER = struct.Struct('<4sB32sQQQQQQBQ')
+
+    # cells are stored up to the last nonzero one, as bytes when they all fit
+    # and as signed 64-bit ints otherwise
+    CELLS_BYTES = 0
+    CELLS_INT64 = 1
+
+    def __init__(self, bf_hash, size, ip, pointer, steps, farthest_nonzero,
+                 loop_stack, cells):
+        self.bf_hash = bf_hash
+        self.size = size
+        self.ip = ip
+        self.pointer = pointer
+        self.steps = steps
+        self.farthest_nonzero = farthest_nonzero
+        self.loop_stack = loop_stack
+        self.cells = cells
+
+    def __repr__(self):
+        return 'Snapshot(ip={}, pointer={}, steps={}, cells={})'.format(
+            self.ip, self.pointer, self.steps, len(self.cells))
+
+    def to_bytes(self):
+        if all(0 <= c <= 255 for c in self.cells):
+            encoding = Snapshot.CELLS_BYTES
+            cells = bytes(self.cells)
+        else:
+            encoding = Snapshot.CELLS_INT64
+            cells = array('q', self.cells).tobytes()
+
+        header = Snapshot.HEADER.pack(
+            Snapshot.MAGIC, Snapshot.VERSION, self.bf_hash, self.size, self.ip,
+            self.pointer, self.steps, self.farthest_nonzero,
+            len(self.loop_stack), encoding, len(self.cells))
+        return header + array('Q', self.loop_stack).tobytes() + cells
+
+    @staticmethod
+    def from_bytes(data):
+        if len(data) < Snapshot.HEADER.size:
+            raise Exception('Truncated snapshot: {} bytes is shorter than the header'
+                            .format(len(data)))
+        magic, version, bf_hash, size, ip, pointer, steps, farthest_nonzero, \
+            depth, encoding, count = Snapshot.HEADER.unpack_from(data)
+        if magic != Snapshot.MAGIC:
+            raise Exception('Not a Brainfuck snapshot')
+        if version != Snapshot.VERSION:
+            raise Exception('Unsupported snapshot version ' + str(version))
+
+        if encoding == Snapshot.CELLS_BYTES:
+            cell_size = 1
+        elif encoding == Snapshot.CELLS_INT64:
+            cell_size = array('q').itemsize
+        else:
+            raise Exception('Unknown snapshot cell encoding ' + str(encoding))
+
+        # a snapshot cut short (e.g. by a crash while it was being written)
+        # would otherwise load with the missing cells silently zeroed
+        loop_stack = array('Q')
+        expected = Snapshot.HEADER.size + depth * loop_stack.itemsize + count * cell_size
+        if len(data) != expected:
+            raise Exception('Corrupt snapshot: expected {} bytes, got {}'
+                            .format(expected, len(data)))
+
+        offset = Snapshot.HEADER.size
+        loop_stack.frombytes(data[offset:offset + depth * loop_stack.itemsize])
+        offset += depth * loop_stack.itemsize
+
+        if encoding == Snapshot.CELLS_BYTES:
+            cells = list(data[offset:])
+        else:
+            cells = array('q')
+            cells.frombytes(data[offset:])
+            cells = cells.tolist()
+
+        return Snapshot(bf_hash, size, ip, pointer, steps, farthest_nonzero,
+                        loop_stack.tolist(), cells)
+
+    def save(self, path):
+        # written to a temporary file next to path and then moved over it, so
+        # a crash mid-write leaves the previous snapshot intact
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(self.to_bytes())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return Snapshot.from_bytes(f.read())
+
 
 class BrainfuckInterpreter(object):
 
+    # superinstruction patterns mined by superinstructions.py, loaded once
+    SUPERINSTRUCTIONS = superinstructions.loadTable()
+
     def __init__(self, size=30000):
         self.cells = [0] * size
         self.pointer = 0
         self.loop_stack = []
         self.farthest_nonzero = 0
+        self.steps = 0
+        self.ip = 0
+
+    # how many instructions run between checks of the time budget
+    TIME_CHECK_INTERVAL = 1024
+
+    def execute(self, bf, print_state=False, step=False, max_steps=None,
+                time_budget=None):
+        self.ip = 0
+        return self.resume(bf, print_state, step, max_steps, time_budget)
+
+    def resume(self, bf, print_state=False, step=False, max_steps=None,
+               time_budget=None):
+        # continues from self.ip; stops early after max_steps instructions or
+        # time_budget seconds and returns False, or True once the program ends
+        i = self.ip
+        stop_at = None if max_steps is None else self.steps + max_steps
+        deadline = None if time_budget is None else time.monotonic() + time_budget
+        countdown = BrainfuckInterpreter.TIME_CHECK_INTERVAL
 
-    def execute(self, bf, print_state=False, step=False):
-        i = 0
         while i < len(bf):
+            if stop_at is not None and self.steps >= stop_at:
+                self.ip = i
+                return False
+            if deadline is not None:
+                countdown -= 1
+                if countdown == 0:
+                    countdown = BrainfuckInterpreter.TIME_CHECK_INTERVAL
+                    if time.monotonic() >= deadline:
+                        self.ip = i
+                        return False
+
             opcode = bf[i]
+            self.steps += 1
 
             if print_state:
                 print((' ' * i) + 'v')
@@ -51,7 +199,8 @@ class BrainfuckInterpreter(object):
             elif opcode == '.':
                 print(chr(self.cells[self.pointer]), end='')
             elif opcode == ',':
-                self.cells[self.pointer] = sys.stdin.read(1)
+                c = sys.stdin.read(1)
+                self.cells[self.pointer] = ord(c) if c else 0
             else:
                 raise Exception('Unrecognized opcode ' + opcode)
 
@@ -63,10 +212,159 @@ class BrainfuckInterpreter(object):
             if print_state and not step:
                 print()
 
+        self.ip = i
         if print_state:
             print((' ' * i) + 'v')
             print(bf)
             self.dump_cells()
+        return True
+
+    @staticmethod
+    def sized_for(bf):
+        # allocates exactly the tape the program can reach when that can be
+        # proven, and the default tape otherwise
+        bounds = tapeBounds(compileOffsets(bf))
+        if bounds is not None and bounds[0] >= 0:
+            return BrainfuckInterpreter(bounds[1] + 1)
+        return BrainfuckInterpreter()
+
+    def execute_offsets(self, bf, patterns=None):
+        # runs the offset-addressed form of the program (see offsets.py);
+        # much faster than execute, but without stepping, state dumps or
+        # pausing. If the pointer is proven to stay on the tape no bounds
+        # checks are made at all, and windows matching the superinstruction
+        # patterns (SUPERINSTRUCTIONS unless given) are fused.
+        code = compileOffsets(bf)
+        bounds = tapeBounds(code)
+
+        if bounds is not None and self.pointer + bounds[0] >= 0 \
+        and self.pointer + bounds[1] < len(self.cells):
+            reach = max(self.farthest_nonzero, self.pointer + bounds[1])
+            if patterns is None:
+                patterns = BrainfuckInterpreter.SUPERINSTRUCTIONS
+            self.run_offsets_unchecked(superinstructions.fuse(code, patterns))
+        else:
+            reach = self.run_offsets_checked(code)
+
+        self.farthest_nonzero = next(
+            (n for n in range(reach, -1, -1) if self.cells[n] != 0), 0)
+        return True
+
+    def run_offsets_checked(self, code):
+        # returns the highest cell touched, so farthest_nonzero can be
+        # recovered without scanning the whole tape
+        cells = self.cells
+        size = len(cells)
+        pointer = self.pointer
+        steps = self.steps
+        reach = max(self.farthest_nonzero, pointer)
+
+        i = 0
+        while i < len(code):
+            op = code[i]
+            opcode = op[0]
+
+            if opcode == UPDATE:
+                _, updates, move, low, high, width = op
+                if pointer + low < 0:
+                    raise Exception('Negative pointer at instruction ' + str(i))
+                if pointer + high >= size:
+                    raise Exception('Pointer past end of tape at instruction ' + str(i))
+                if pointer + high > reach:
+                    reach = pointer + high
+                for offset, delta in updates:
+                    cells[pointer + offset] += delta
+                pointer += move
+                steps += width
+            elif opcode == OPEN:
+                steps += 1
+                if cells[pointer] == 0:
+                    i = op[1]
+            elif opcode == CLOSE:
+                steps += 1
+                if cells[pointer] != 0:
+                    i = op[1]
+            elif opcode == OUTPUT:
+                steps += 1
+                print(chr(cells[pointer]), end='')
+            elif opcode == INPUT:
+                steps += 1
+                c = sys.stdin.read(1)
+                cells[pointer] = ord(c) if c else 0
+
+            i += 1
+
+        self.pointer = pointer
+        self.steps = steps
+        return reach
+
+    def run_offsets_unchecked(self, code):
+        # same as run_offsets_checked, for code proven by tapeBounds to stay
+        # on the tape
+        cells = self.cells
+        pointer = self.pointer
+        steps = self.steps
+
+        i = 0
+        while i < len(code):
+            op = code[i]
+            opcode = op[0]
+
+            if opcode == UPDATE:
+                _, updates, move, _, _, width = op
+                for offset, delta in updates:
+                    cells[pointer + offset] += delta
+                pointer += move
+                steps += width
+            elif opcode == FUSED:
+                pointer, i, fused_steps = op[1](cells, pointer)
+                steps += fused_steps
+                continue
+            elif opcode == OPEN:
+                steps += 1
+                if cells[pointer] == 0:
+                    i = op[1]
+            elif opcode == CLOSE:
+                steps += 1
+                if cells[pointer] != 0:
+                    i = op[1]
+            elif opcode == OUTPUT:
+                steps += 1
+                print(chr(cells[pointer]), end='')
+            elif opcode == INPUT:
+                steps += 1
+                c = sys.stdin.read(1)
+                cells[pointer] = ord(c) if c else 0
+
+            i += 1
+
+        self.pointer = pointer
+        self.steps = steps
+
+    def snapshot(self, bf):
+        used = len(self.cells)
+        while used > 0 and self.cells[used - 1] == 0:
+            used -= 1
+        return Snapshot(program_hash(bf), len(self.cells), self.ip,
+                        self.pointer, self.steps, self.farthest_nonzero,
+                        list(self.loop_stack), self.cells[:used])
+
+    def restore(self, bf, snapshot):
+        if snapshot.bf_hash != program_hash(bf):
+            raise Exception('Snapshot was taken from a different program')
+
+        self.cells = snapshot.cells + [0] * (snapshot.size - len(snapshot.cells))
+        self.pointer = snapshot.pointer
+        self.loop_stack = list(snapshot.loop_stack)
+        self.farthest_nonzero = snapshot.farthest_nonzero
+        self.steps = snapshot.steps
+        self.ip = snapshot.ip
+
+    @staticmethod
+    def from_snapshot(bf, snapshot):
+        interp = BrainfuckInterpreter(snapshot.size)
+        interp.restore(bf, snapshot)
+        return interp
 
     def dump_cells(self, until=None):
         if until is None:
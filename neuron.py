@@ -1,10 +1,14 @@
+import argparse
 import traceback
 import sys
 from interp import BrainfuckInterpreter
-from cast import CASTVisitor, addJumps, addLabels, getProgram
+from cast import CASTVisitor, addJumps, addLabels, getProgram, iterBasicBlocks, iterLabels, iterValueNumbered, valueNumberProgram
 from pycparser.c_parser import CParser
 from bil import BILVisitor
-from bf_out import BrainfuckVisitor
+from bf_out import BrainfuckVisitor, iterFlattened
+from instr import Opcode
+from offsets import compileOffsets, tapeBounds
+from stats import CompileStats, NullStats
 
 
 __author__ = 'Michael Storm'
@@ -12,15 +16,22 @@ __author__ = 'Michael Storm'
 
 def print_bytecode(bytecode):
     for code in bytecode:
-        if code[0] == 'label':
-            print('%s:' % code[1])
+        if code.opcode == Opcode.LABEL:
+            print('%s:' % code.args[0])
         else:
-            print('\t%s' % ' '.join([str(c) for c in code]))
+            print('\t%s' % code)
 
 
-parser = CParser()
+def stream_bf(func_def):
+    # chains the per-instruction stages lazily, so apart from the bytecode
+    # itself only the basic block being lowered is held in memory
+    bytecode = CASTVisitor().visitMain(func_def)
+    blocks = iterValueNumbered(iterBasicBlocks(iterLabels(bytecode)))
+    bil = BILVisitor().iterBlocks(blocks)
+    return iterFlattened(BrainfuckVisitor().iterBIL(bil))
 
-buf = r'''
+
+default_source = r'''
     static void foo()
     {
         char x;
@@ -31,45 +42,151 @@ buf = r'''
     }
 '''
 
-c_ast = parser.parse(buf, 'x.c')
-c_ast.show()
-print("#######")
 
-v = CASTVisitor()
-bytecode = v.visitMain(c_ast.ext[0])
-print('\nbytecode: ' + str(bytecode))
+def count_nodes(node):
+    return 1 + sum(count_nodes(child) for _, child in node.children())
+
 
-labeled_bytecode = addLabels(bytecode)
-print('\nlabeled bytecode:')
-print_bytecode(labeled_bytecode)
+def compile_source(buf, stats=None, filename='x.c'):
+    # runs every stage of the compiler without the debug dumps and returns the
+    # flattened BF along with the (low, high) tape offsets it can reach, or
+    # None for the bounds if they can't be proven; pass a CompileStats to have
+    # each stage measured
+    if stats is None:
+        stats = NullStats()
 
-jump_bytecode = addJumps(labeled_bytecode)
-print('\njump bytecode:')
-print_bytecode(jump_bytecode)
+    with stats.stage('parse', len(buf), 'chars', 'nodes') as s:
+        c_ast = CParser().parse(buf, filename)
+        s.count_out = count_nodes(c_ast)
 
-program = getProgram(labeled_bytecode)
-print('\nbasic blocks: ' + str(program))
+    with stats.stage('cast', s.count_out, 'nodes', 'ops') as s:
+        bytecode = CASTVisitor().visitMain(c_ast.ext[0])
+        s.count_out = len(bytecode)
 
-bilVisitor = BILVisitor()
-bil = bilVisitor.visitProgram(program)
-# bil = bilVisitor.visitBytecode(labeled_bytecode)
-print('\nbil: ')
-print_bytecode(bil)
+    with stats.stage('addLabels', len(bytecode), 'ops', 'ops') as s:
+        labeled_bytecode = addLabels(bytecode)
+        s.count_out = len(labeled_bytecode)
 
-# ops = [Add(1, 1), Add(2, 1), And(3, [1, 2])]
+    with stats.stage('addJumps', len(labeled_bytecode), 'ops', 'ops') as s:
+        jump_bytecode = addJumps(labeled_bytecode)
+        s.count_out = len(jump_bytecode)
 
-# print('\nops:')
-# dump_ops(ops)
+    with stats.stage('getProgram', len(labeled_bytecode), 'ops', 'blocks') as s:
+        program = getProgram(labeled_bytecode)
+        s.count_out = len(program.blocks)
 
-bfVisitor = BrainfuckVisitor()
-bf = bfVisitor.visitBIL(bil)
-print('\nbf:')
-for pair in bf:
-	pair.dump(0)
+    program_size = sum(len(block.instrs) for block in program.blocks.values())
+    with stats.stage('valueNumbering', program_size, 'ops', 'ops') as s:
+        s.details['move loops saved'] = valueNumberProgram(program)
+        program_size = sum(len(block.instrs) for block in program.blocks.values())
+        s.count_out = program_size
+
+    with stats.stage('bil', program_size, 'ops', 'ops') as s:
+        bil = BILVisitor().visitProgram(program)
+        s.count_out = len(bil)
+
+    with stats.stage('bf', len(bil), 'ops', 'chars') as s:
+        bf = BrainfuckVisitor().visitBIL(bil)
+        flat_bf = ''.join(iterFlattened(bf))
+        s.count_out = len(flat_bf)
+
+    with stats.stage('bounds', len(flat_bf), 'chars', 'cells') as s:
+        bounds = tapeBounds(compileOffsets(flat_bf))
+        if bounds is not None:
+            s.count_out = bounds[1] - bounds[0] + 1
+
+    return flat_bf, bounds
+
+
+def demo(buf):
+    parser = CParser()
+
+    c_ast = parser.parse(buf, 'x.c')
+    c_ast.show()
+    print("#######")
+
+    v = CASTVisitor(debug=True)
+    bytecode = v.visitMain(c_ast.ext[0])
+    print('\nbytecode: ' + str(bytecode))
+
+    labeled_bytecode = addLabels(bytecode)
+    print('\nlabeled bytecode:')
+    print_bytecode(labeled_bytecode)
+
+    jump_bytecode = addJumps(labeled_bytecode)
+    print('\njump bytecode:')
+    print_bytecode(jump_bytecode)
+
+    program = getProgram(labeled_bytecode)
+    print('\nbasic blocks: ' + str(program))
+
+    saved = valueNumberProgram(program)
+    print('\nvalue numbering saved {} move loops: {}'.format(saved, program))
+
+    bilVisitor = BILVisitor(debug=True)
+    bil = bilVisitor.visitProgram(program)
+    # bil = bilVisitor.visitBytecode(labeled_bytecode)
+    print('\nbil: ')
+    print_bytecode(bil)
+
+    # ops = [Add(1, 1), Add(2, 1), And(3, [1, 2])]
+
+    # print('\nops:')
+    # dump_ops(ops, Lowerer(4))
+
+    bfVisitor = BrainfuckVisitor()
+    bf = bfVisitor.visitBIL(bil)
+    print('\nbf:')
+    for pair in bf:
+        pair.dump(0)
+
+    flat_bf = ''.join(iterFlattened(bf))
+
+    interp = BrainfuckInterpreter()
+    interp.execute(flat_bf, print_state=True, step=True)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Compile C to Brainfuck.')
+    arg_parser.add_argument('source', nargs='?',
+                            help='C file to compile (defaults to a built-in example)')
+    arg_parser.add_argument('--stats', action='store_true',
+                            help='compile without the debug dumps and report '
+                                 'time, peak memory and instruction counts '
+                                 'for each stage')
+    arg_parser.add_argument('--json', action='store_true',
+                            help='report --stats as JSON instead of a table')
+    args = arg_parser.parse_args(argv)
+
+    if args.source is not None:
+        with open(args.source) as f:
+            buf = f.read()
+    else:
+        buf = default_source
+
+    if not args.stats:
+        demo(buf)
+        return
+
+    stats = CompileStats()
+    try:
+        compile_source(buf, stats, filename=args.source or 'x.c')
+    finally:
+        # peak memory comes from a second, traced compile so that tracing
+        # doesn't inflate the times; it fails at the same stage as the first
+        traced = CompileStats(trace_memory=True)
+        try:
+            compile_source(buf, traced, filename=args.source or 'x.c')
+        except Exception:
+            pass
+        stats.merge_peaks(traced)
+
+        # report whatever completed, even if a later stage failed
+        if args.json:
+            print(stats.to_json(), file=sys.stderr)
+        else:
+            print(stats.format_table(), file=sys.stderr)
 
-flat_bf = ''
-for child in bf:
-    flat_bf += child.flattened()
 
-interp = BrainfuckInterpreter()
-interp.execute(flat_bf, print_state=True, step=True)
+if __name__ == '__main__':
+    main()
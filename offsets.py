@@ -0,0 +1,113 @@
+# Offset-addressed form of a BF program. Each straight-line run of + - < > is
+# folded into a single UPDATE that adds a delta to cells at fixed offsets from
+# the pointer and then moves the pointer once, so "move k, modify, move back"
+# sequences cost one dispatch and a balanced loop body carries no pointer
+# movement at all.
+#
+# Instructions are plain tuples, unpacked once per dispatch:
+#   (UPDATE, ((offset, delta), ...), move, low, high, width)
+#   (OPEN, partner)
+#   (CLOSE, partner)
+#   (OUTPUT,)
+#   (INPUT,)
+#   (FUSED, fn)
+# low and high are the lowest and highest offsets the pointer reaches during
+# the UPDATE, including partway through it, and width is how many BF
+# characters it replaces. A run with no net effect, like <> or +-, still
+# becomes an (empty) UPDATE so its width is counted and its bounds checked.
+# FUSED instructions are never produced by compileOffsets; they are
+# superinstructions patched in by superinstructions.fuse.
+
+UPDATE = 0
+OPEN = 1
+CLOSE = 2
+OUTPUT = 3
+INPUT = 4
+FUSED = 5
+
+
+def compileOffsets(bf):
+    code = []
+    loop_stack = []
+    deltas = {}
+    move = 0
+    low = 0
+    high = 0
+    width = 0
+
+    def flush():
+        nonlocal deltas, move, low, high, width
+        if width == 0:
+            return
+        updates = tuple((offset, delta) for offset, delta in deltas.items() if delta != 0)
+        code.append((UPDATE, updates, move, low, high, width))
+        deltas = {}
+        move = 0
+        low = 0
+        high = 0
+        width = 0
+
+    for opcode in bf:
+        if opcode == '>':
+            move += 1
+            high = max(high, move)
+            width += 1
+        elif opcode == '<':
+            move -= 1
+            low = min(low, move)
+            width += 1
+        elif opcode == '+':
+            deltas[move] = deltas.get(move, 0) + 1
+            width += 1
+        elif opcode == '-':
+            deltas[move] = deltas.get(move, 0) - 1
+            width += 1
+        elif opcode == '[':
+            flush()
+            loop_stack.append(len(code))
+            code.append(None)
+        elif opcode == ']':
+            flush()
+            if not loop_stack:
+                raise Exception('Unmatched ] at instruction ' + str(len(code)))
+            start = loop_stack.pop()
+            code[start] = (OPEN, len(code))
+            code.append((CLOSE, start))
+        elif opcode == '.':
+            flush()
+            code.append((OUTPUT,))
+        elif opcode == ',':
+            flush()
+            code.append((INPUT,))
+        else:
+            raise Exception('Unrecognized opcode ' + opcode)
+
+    flush()
+    if loop_stack:
+        raise Exception('Unmatched [ at instruction ' + str(loop_stack[-1]))
+    return code
+
+
+def tapeBounds(code):
+    # abstract interpretation of the pointer: while every loop body is
+    # balanced, the pointer offset at each instruction is the same on every
+    # iteration, so the lowest and highest cells the program can touch are
+    # known exactly. Returns (low, high) relative to the starting cell, or
+    # None if some loop moves the pointer by a nonzero net amount.
+    pointer = 0
+    low = 0
+    high = 0
+    loop_starts = []
+
+    for op in code:
+        if op[0] == UPDATE:
+            low = min(low, pointer + op[3])
+            high = max(high, pointer + op[4])
+            pointer += op[2]
+        elif op[0] == OPEN:
+            loop_starts.append(pointer)
+        elif op[0] == CLOSE:
+            if loop_starts.pop() != pointer:
+                return None
+
+    return low, high
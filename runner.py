@@ -0,0 +1,289 @@
+import argparse
+from collections import OrderedDict, deque
+import contextlib
+import hashlib
+import io
+import json
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+import sys
+import time
+
+from interp import BrainfuckInterpreter
+
+
+# seconds past a job's timeout before the parent stops waiting for the
+# worker to notice and kills it
+KILL_GRACE = 1.0
+
+
+class Job(object):
+    # program is BF text, or C source when language is 'c'. max_steps and
+    # timeout (seconds, counted from when the job starts, compile included)
+    # bound the run; None means unlimited.
+
+    def __init__(self, job_id, program, input='', language='bf',
+                 max_steps=None, timeout=None):
+        self.job_id = job_id
+        self.program = program
+        self.input = input
+        self.language = language
+        self.max_steps = max_steps
+        self.timeout = timeout
+
+    def __repr__(self):
+        return 'Job(job_id={!r}, language={!r}, max_steps={}, timeout={})'.format(
+            self.job_id, self.language, self.max_steps, self.timeout)
+
+
+class JobResult(object):
+    # status is 'ok', 'budget' (ran out of instructions), 'timeout' or
+    # 'error'. A job stopped by its budget or timeout carries an interp
+    # Snapshot, so it can be resumed later, unless its worker had to be
+    # killed.
+
+    def __init__(self, job_id, status, output='', steps=0, seconds=0.0,
+                 error=None, snapshot=None):
+        self.job_id = job_id
+        self.status = status
+        self.output = output
+        self.steps = steps
+        self.seconds = seconds
+        self.error = error
+        self.snapshot = snapshot
+
+    def __repr__(self):
+        return 'JobResult(job_id={!r}, status={!r}, steps={}, seconds={:.3f})'.format(
+            self.job_id, self.status, self.steps, self.seconds)
+
+    def as_dict(self):
+        return {
+            'id': self.job_id,
+            'status': self.status,
+            'output': self.output,
+            'steps': self.steps,
+            'seconds': self.seconds,
+            'error': self.error,
+        }
+
+
+# compiled BF by (language, hash of the program), kept for the life of each
+# worker process so repeated programs are only compiled once per worker. Only
+# the most recently used MAX_COMPILED_PROGRAMS are kept, so a long-running
+# worker fed many different programs doesn't hold on to all of them.
+MAX_COMPILED_PROGRAMS = 128
+compiled_cache = OrderedDict()
+
+
+def compile_job(job):
+    key = (job.language, hashlib.sha256(job.program.encode('utf-8')).digest())
+    bf = compiled_cache.get(key)
+    if bf is not None:
+        compiled_cache.move_to_end(key)
+    else:
+        if job.language == 'bf':
+            bf = ''.join(c for c in job.program if c in '<>+-[].,')
+        elif job.language == 'c':
+            # imported here so BF-only workers don't need pycparser
+            from neuron import compile_source
+            with contextlib.redirect_stdout(io.StringIO()):
+                bf, _ = compile_source(job.program)
+        else:
+            raise Exception('Unsupported job language ' + job.language)
+        compiled_cache[key] = bf
+        while len(compiled_cache) > MAX_COMPILED_PROGRAMS:
+            compiled_cache.popitem(last=False)
+    return bf
+
+
+def run_job(job):
+    start = time.perf_counter()
+    output = io.StringIO()
+    interp = None
+    try:
+        bf = compile_job(job)
+        interp = BrainfuckInterpreter()
+        time_budget = None
+        if job.timeout is not None:
+            time_budget = job.timeout - (time.perf_counter() - start)
+            if time_budget <= 0:
+                return JobResult(job.job_id, 'timeout', '', 0,
+                                 time.perf_counter() - start,
+                                 snapshot=interp.snapshot(bf))
+        with contextlib.redirect_stdout(output):
+            stdin = sys.stdin
+            sys.stdin = io.StringIO(job.input)
+            try:
+                finished = interp.execute(bf, max_steps=job.max_steps,
+                                          time_budget=time_budget)
+            finally:
+                sys.stdin = stdin
+    except Exception as e:
+        return JobResult(job.job_id, 'error', output.getvalue(),
+                         interp.steps if interp is not None else 0,
+                         time.perf_counter() - start, str(e))
+
+    seconds = time.perf_counter() - start
+    if finished:
+        return JobResult(job.job_id, 'ok', output.getvalue(), interp.steps, seconds)
+
+    if job.max_steps is not None and interp.steps >= job.max_steps:
+        status = 'budget'
+    else:
+        status = 'timeout'
+    return JobResult(job.job_id, status, output.getvalue(), interp.steps,
+                     seconds, snapshot=interp.snapshot(bf))
+
+
+def serve(conn):
+    # worker process: runs jobs from the parent until it sends None
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        conn.send(run_job(job))
+
+
+class Worker(object):
+    # one worker process and the pipe to it, so a stuck or crashed worker can
+    # be killed and replaced without disturbing the others
+
+    def __init__(self):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve, args=(child,),
+                                               daemon=True)
+        self.process.start()
+        child.close()
+        self.job = None
+        self.started = None
+        self.kill_at = None
+
+    def submit(self, job):
+        self.job = job
+        self.started = time.perf_counter()
+        self.kill_at = None
+        if job.timeout is not None:
+            self.kill_at = self.started + job.timeout + KILL_GRACE
+        self.conn.send(job)
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join()
+        self.conn.close()
+
+
+def run_jobs(jobs, workers=None):
+    # runs jobs in worker processes and yields each JobResult as soon as it
+    # finishes, not in submission order. A job still running KILL_GRACE
+    # seconds after its timeout has its worker killed and replaced, and a
+    # worker that dies mid-job gives an 'error' result; either way the
+    # remaining jobs carry on.
+    pending = deque(jobs)
+    idle = [Worker() for _ in range(min(workers or os.cpu_count() or 1,
+                                        len(pending)))]
+    busy = {}
+
+    try:
+        while pending or busy:
+            while pending and idle:
+                worker = idle.pop()
+                worker.submit(pending.popleft())
+                busy[worker.conn] = worker
+
+            kill_times = [w.kill_at for w in busy.values() if w.kill_at is not None]
+            timeout = None
+            if kill_times:
+                timeout = max(min(kill_times) - time.perf_counter(), 0)
+
+            for conn in wait(list(busy), timeout):
+                worker = busy.pop(conn)
+                try:
+                    result = conn.recv()
+                except (EOFError, OSError):
+                    worker.kill()
+                    result = JobResult(
+                        worker.job.job_id, 'error',
+                        seconds=time.perf_counter() - worker.started,
+                        error='worker exited with code {}'.format(worker.process.exitcode))
+                    worker = Worker() if pending else None
+                if worker is not None:
+                    idle.append(worker)
+                yield result
+
+            now = time.perf_counter()
+            for conn, worker in list(busy.items()):
+                if worker.kill_at is not None and now >= worker.kill_at:
+                    del busy[conn]
+                    worker.kill()
+                    if pending:
+                        idle.append(Worker())
+                    yield JobResult(worker.job.job_id, 'timeout',
+                                    seconds=now - worker.started,
+                                    error='worker killed after the timeout')
+    finally:
+        for worker in idle:
+            worker.close()
+        for worker in busy.values():
+            worker.kill()
+
+
+def load_jobs(f, default_max_steps=None, default_timeout=None):
+    # one JSON object per line: id, then program (or file), and optionally
+    # input, language, max_steps and timeout
+    jobs = []
+    for n, line in enumerate(f):
+        line = line.strip()
+        if not line:
+            continue
+        spec = json.loads(line)
+        if 'program' in spec:
+            program = spec['program']
+        else:
+            with open(spec['file']) as source:
+                program = source.read()
+        language = spec.get('language')
+        if language is None:
+            language = 'c' if spec.get('file', '').endswith('.c') else 'bf'
+        jobs.append(Job(spec.get('id', n), program, spec.get('input', ''), language,
+                        spec.get('max_steps', default_max_steps),
+                        spec.get('timeout', default_timeout)))
+    return jobs
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        description='Run many BF or C programs concurrently with per-job limits.')
+    arg_parser.add_argument('jobs', nargs='?',
+                            help='JSON-lines job file (defaults to stdin)')
+    arg_parser.add_argument('--workers', type=int, default=None,
+                            help='worker processes (defaults to the CPU count)')
+    arg_parser.add_argument('--max-steps', type=int, default=None,
+                            help='instruction budget for jobs that set none')
+    arg_parser.add_argument('--timeout', type=float, default=None,
+                            help='wall-clock seconds for jobs that set none')
+    args = arg_parser.parse_args(argv)
+
+    if args.jobs is None:
+        jobs = load_jobs(sys.stdin, args.max_steps, args.timeout)
+    else:
+        with open(args.jobs) as f:
+            jobs = load_jobs(f, args.max_steps, args.timeout)
+
+    failed = False
+    for result in run_jobs(jobs, args.workers):
+        print(json.dumps(result.as_dict()), flush=True)
+        failed = failed or result.status != 'ok'
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
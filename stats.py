@@ -0,0 +1,136 @@
+from contextlib import contextmanager
+import json
+import time
+import tracemalloc
+
+
+class StageStats(object):
+
+    def __init__(self, name, count_in=None, unit_in=None, unit_out=None):
+        self.name = name
+        self.seconds = 0.0
+        self.peak_bytes = None
+        self.count_in = count_in
+        self.count_out = None
+        self.unit_in = unit_in
+        self.unit_out = unit_out
+        self.failed = False
+        # anything else a stage wants to report, e.g. how much a pass saved
+        self.details = {}
+
+    def ratio(self):
+        if self.count_in and self.count_out is not None:
+            return self.count_out / self.count_in
+        return None
+
+    def as_dict(self):
+        return {
+            'stage': self.name,
+            'seconds': self.seconds,
+            'peak_bytes': self.peak_bytes,
+            'count_in': self.count_in,
+            'unit_in': self.unit_in,
+            'count_out': self.count_out,
+            'unit_out': self.unit_out,
+            'ratio': self.ratio(),
+            'failed': self.failed,
+            'details': self.details,
+        }
+
+
+class CompileStats(object):
+
+    def __init__(self, trace_memory=False):
+        # tracemalloc slows allocation-heavy stages down several times over,
+        # so a traced run's times are not worth keeping; time one run and
+        # trace another, then combine them with merge_peaks
+        self.stages = []
+        self.trace_memory = trace_memory
+
+    @contextmanager
+    def stage(self, name, count_in=None, unit_in=None, unit_out=None):
+        # the caller fills in count_out on the yielded StageStats; peak memory
+        # is what the stage allocated on top of what was live when it started
+        s = StageStats(name, count_in, unit_in, unit_out)
+        self.stages.append(s)
+
+        started_tracing = False
+        if self.trace_memory:
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+
+        try:
+            yield s
+        except BaseException:
+            s.failed = True
+            raise
+        finally:
+            s.seconds = time.perf_counter() - start
+            if self.trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                s.peak_bytes = max(peak - baseline, 0)
+                if started_tracing:
+                    tracemalloc.stop()
+
+    def merge_peaks(self, traced):
+        # copies the peak memory of each stage from a run with trace_memory on
+        for s, t in zip(self.stages, traced.stages):
+            if s.name == t.name:
+                s.peak_bytes = t.peak_bytes
+
+    def total_seconds(self):
+        return sum(s.seconds for s in self.stages)
+
+    def as_dict(self):
+        return {
+            'stages': [s.as_dict() for s in self.stages],
+            'total_seconds': self.total_seconds(),
+        }
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=2)
+
+    def format_table(self):
+        def count(n, unit):
+            return '' if n is None else '{} {}'.format(n, unit or '')
+
+        rows = [('stage', 'time (ms)', 'peak (KiB)', 'in', 'out', 'ratio')]
+        for s in self.stages:
+            ratio = s.ratio()
+            rows.append((
+                s.name + (' (failed)' if s.failed else ''),
+                '{:.3f}'.format(s.seconds * 1000),
+                '' if s.peak_bytes is None else '{:.1f}'.format(s.peak_bytes / 1024),
+                count(s.count_in, s.unit_in).strip(),
+                count(s.count_out, s.unit_out).strip(),
+                '' if ratio is None else '{:.2f}'.format(ratio),
+            ))
+        details = [(s.name, key, value) for s in self.stages
+                   for key, value in s.details.items()]
+        rows.append(('total', '{:.3f}'.format(self.total_seconds() * 1000),
+                     '', '', '', ''))
+
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        lines = []
+        for n, row in enumerate(rows):
+            lines.append('  '.join(
+                cell.ljust(w) if i == 0 else cell.rjust(w)
+                for i, (cell, w) in enumerate(zip(row, widths))))
+            if n == 0 or n == len(rows) - 2:
+                lines.append('  '.join('-' * w for w in widths))
+        for name, key, value in details:
+            lines.append('{}: {} {}'.format(name, value, key))
+        return '\n'.join(lines)
+
+
+class NullStats(CompileStats):
+    # stands in for CompileStats when instrumentation is off, so callers can
+    # wrap stages unconditionally without paying for the timer
+
+    @contextmanager
+    def stage(self, name, count_in=None, unit_in=None, unit_out=None):
+        yield StageStats(name, count_in, unit_in, unit_out)
@@ -0,0 +1,234 @@
+import argparse
+from collections import Counter, OrderedDict
+import json
+import os
+import sys
+
+from offsets import CLOSE, FUSED, INPUT, OPEN, OUTPUT, UPDATE, compileOffsets
+
+
+# Superinstructions fuse a window of consecutive offset-IR instructions (see
+# offsets.py) into one generated Python function, so the interpreter makes one
+# dispatch where it used to make several. Which windows are worth fusing is
+# mined by profiling a corpus: a pattern is the sequence of opcode names in a
+# window, e.g. OPEN UPDATE CLOSE for loops like [->+<], and the most
+# profitable patterns are stored in a versioned table that interp.py loads at
+# startup.
+
+TABLE_VERSION = 1
+TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'superinstructions.json')
+
+OPCODE_NAMES = {UPDATE: 'UPDATE', OPEN: 'OPEN', CLOSE: 'CLOSE', OUTPUT: 'OUTPUT', INPUT: 'INPUT'}
+
+
+def patternOf(window):
+    return tuple(OPCODE_NAMES[op[0]] for op in window)
+
+
+def isLoop(code, start, length):
+    # whether the window is exactly one loop, from its OPEN to its CLOSE
+    return code[start][0] == OPEN and code[start][1] == start + length - 1
+
+
+def profile(code, max_length=4):
+    # runs the program and returns a Counter of dispatches each candidate
+    # window would have saved, by pattern. A straight-line window saves
+    # length - 1 dispatches each time it runs start to end; a whole loop
+    # saves every dispatch inside it after the first.
+    cells = [0] * 30000
+    pointer = 0
+    executed = [0] * len(code)
+    straight = Counter()
+    # how many instructions in a row, ending at the current one, ran in
+    # program order
+    run = 0
+
+    i = 0
+    while i < len(code):
+        op = code[i]
+        opcode = op[0]
+        executed[i] += 1
+        for length in range(2, min(run + 1, max_length) + 1):
+            straight[(i - length + 1, length)] += 1
+
+        next_i = i + 1
+        if opcode == UPDATE:
+            for offset, delta in op[1]:
+                cells[pointer + offset] += delta
+            pointer += op[2]
+        elif opcode == OPEN:
+            if cells[pointer] == 0:
+                next_i = op[1] + 1
+        elif opcode == CLOSE:
+            if cells[pointer] != 0:
+                next_i = op[1] + 1
+        elif opcode == INPUT:
+            cells[pointer] = 0
+
+        run = run + 1 if next_i == i + 1 else 0
+        i = next_i
+
+    saved = Counter()
+    for (start, length), count in straight.items():
+        if not isLoop(code, start, length):
+            saved[patternOf(code[start:start + length])] += count * (length - 1)
+
+    for start, op in enumerate(code):
+        if op[0] == OPEN and op[1] - start + 1 <= max_length:
+            length = op[1] - start + 1
+            window = code[start:start + length]
+            inside = sum(executed[start:start + length])
+            if inside > executed[start]:
+                saved[patternOf(window)] += inside - executed[start]
+    return saved
+
+
+def mine(programs, top=16, max_length=4):
+    # programs is an iterable of BF source; returns the table as a dict
+    saved = Counter()
+    count = 0
+    for bf in programs:
+        saved.update(profile(compileOffsets(bf), max_length))
+        count += 1
+
+    patterns = [{'pattern': list(pattern), 'saved': n}
+                for pattern, n in saved.most_common(top) if n > 0]
+    return {'version': TABLE_VERSION, 'programs': count, 'patterns': patterns}
+
+
+def loadTable(path=TABLE_PATH):
+    # returns the patterns in the table as tuples, most profitable first, or
+    # an empty list if there is no table
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        table = json.load(f)
+    if table.get('version') != TABLE_VERSION:
+        raise Exception('Unsupported superinstruction table version ' + str(table.get('version')))
+    return [tuple(entry['pattern']) for entry in table['patterns']]
+
+
+def generate(code, start, length):
+    # Python source for a function (cells, pointer) -> (pointer, next index,
+    # steps) that runs code[start:start + length] with its operands inlined.
+    # Loops wholly inside the window become while loops; jumps out of it
+    # return the index to continue from. No bounds checks are made, so this
+    # is only for code proven to stay on the tape.
+    lines = ['def fused(cells, p):', '    s = 0']
+    indent = 1
+    end = start + length
+
+    for i in range(start, end):
+        op = code[i]
+        opcode = op[0]
+        pad = '    ' * indent
+
+        if opcode == UPDATE:
+            _, updates, move, _, _, width = op
+            for offset, delta in updates:
+                lines.append('{}cells[p + {}] += {}'.format(pad, offset, delta))
+            if move:
+                lines.append('{}p += {}'.format(pad, move))
+            lines.append('{}s += {}'.format(pad, width))
+        elif opcode == OPEN:
+            lines.append('{}s += 1'.format(pad))
+            if op[1] < end:
+                lines.append('{}while cells[p]:'.format(pad))
+                indent += 1
+            else:
+                lines.append('{}if cells[p] == 0:'.format(pad))
+                lines.append('{}    return p, {}, s'.format(pad, op[1] + 1))
+        elif opcode == CLOSE:
+            if op[1] >= start:
+                lines.append('{}s += 1'.format(pad))
+                indent -= 1
+            else:
+                lines.append('{}s += 1'.format(pad))
+                lines.append('{}if cells[p] != 0:'.format(pad))
+                lines.append('{}    return p, {}, s'.format(pad, op[1] + 1))
+        elif opcode == OUTPUT:
+            lines.append("{}print(chr(cells[p]), end='')".format(pad))
+            lines.append('{}s += 1'.format(pad))
+        elif opcode == INPUT:
+            lines.append('{}c = sys.stdin.read(1)'.format(pad))
+            lines.append('{}cells[p] = ord(c) if c else 0'.format(pad))
+            lines.append('{}s += 1'.format(pad))
+
+    lines.append('    return p, {}, s'.format(end))
+    return '\n'.join(lines) + '\n'
+
+
+# generated functions by (start, window), so running the same program again
+# doesn't regenerate them. Only the most recently used MAX_COMPILED_WINDOWS
+# are kept, so a process running many different programs doesn't hold on to
+# every function it ever generated.
+MAX_COMPILED_WINDOWS = 1024
+compiled_windows = OrderedDict()
+
+
+def compileWindow(code, start, length):
+    key = (start, tuple(code[start:start + length]))
+    fn = compiled_windows.get(key)
+    if fn is None:
+        namespace = {'sys': sys}
+        exec(generate(code, start, length), namespace)
+        fn = namespace['fused']
+        compiled_windows[key] = fn
+        while len(compiled_windows) > MAX_COMPILED_WINDOWS:
+            compiled_windows.popitem(last=False)
+    else:
+        compiled_windows.move_to_end(key)
+    return fn
+
+
+def fuse(code, patterns):
+    # returns a copy of code where the first instruction of each window
+    # matching a pattern is replaced by (FUSED, fn). The window's other
+    # instructions stay in place, since jumps from outside can land on them.
+    fused = list(code)
+    names = [OPCODE_NAMES[op[0]] for op in code]
+
+    for pattern in patterns:
+        length = len(pattern)
+        for start in range(len(code) - length + 1):
+            if fused[start][0] == FUSED or tuple(names[start:start + length]) != pattern:
+                continue
+            fused[start] = (FUSED, compileWindow(code, start, length))
+    return fused
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        description='Mine superinstructions from the execution profile of BF programs.')
+    arg_parser.add_argument('programs', nargs='*',
+                            help='BF files to profile (defaults to bench/kernels)')
+    arg_parser.add_argument('--top', type=int, default=16,
+                            help='number of patterns to keep')
+    arg_parser.add_argument('--max-length', type=int, default=4,
+                            help='longest window, in offset-IR instructions')
+    arg_parser.add_argument('-o', '--output', default=TABLE_PATH)
+    args = arg_parser.parse_args(argv)
+
+    paths = args.programs
+    if not paths:
+        kernels = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench', 'kernels')
+        paths = [os.path.join(kernels, name) for name in sorted(os.listdir(kernels))
+                 if name.endswith('.bf')]
+
+    programs = []
+    for path in paths:
+        with open(path) as f:
+            programs.append(''.join(c for c in f.read() if c in '<>+-[].,'))
+
+    table = mine(programs, args.top, args.max_length)
+    with open(args.output, 'w') as f:
+        json.dump(table, f, indent=2)
+        f.write('\n')
+
+    for entry in table['patterns']:
+        print('{:>10}  {}'.format(entry['saved'], ' '.join(entry['pattern'])))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
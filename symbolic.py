@@ -1,13 +1,3 @@
-class SymbolicBF(object):
-
-    def __init__(self):
-        self.ops = []
-        self.locs = []
-
-    def add(self, children):
-        self.ops.append(children[0])
-        self.locs.extend(children[1])
-
 class DefaultRepr(object):
 
     def __repr__(self):
@@ -17,25 +7,47 @@ class DefaultRepr(object):
         return str_impl(self, sorted(set(self.__dict__)))
 
 class SymbolicLocation(DefaultRepr):
+    # a cell offset that isn't known when an op is expanded, such as a scratch
+    # cell handed out by the Lowerer. A root location is bound to an offset;
+    # derived ones (work - src, src * -1, ...) resolve from it, once.
 
     def __init__(self, value=None, op=None):
         self.value = value
         self.op = op
+        self.resolved = None
+
+    def bind(self, value):
+        if self.op is not None:
+            raise Exception('Only a root SymbolicLocation can be bound')
+        self.value = value
+        self.resolved = None
+
+    def resolve(self):
+        if self.resolved is None:
+            if self.op is None:
+                if self.value is None:
+                    raise Exception('Unbound SymbolicLocation %s' % self)
+                self.resolved = self.value
+            else:
+                self.resolved = self.apply_op(resolve(self.value), resolve(self.op[1]))
+        return self.resolved
 
-    def apply_op(self):
+    def apply_op(self, value, operand):
         if self.op[0] == 'add':
-            return self.value + op[1]
+            return value + operand
         elif self.op[0] == 'sub':
-            return self.value - op[1]
+            return value - operand
+        elif self.op[0] == 'rsub':
+            return operand - value
         elif self.op[0] == 'mul':
-            return self.value * op[1]
-
-    def apply_value(self, value):
-        if self.value is None:
-            self.value = value
-            return self.apply_op()
+            return value * operand
         else:
-            return self.value.apply_value(value)
+            raise Exception('Unknown SymbolicLocation op %s' % self.op[0])
+
+    def __str__(self):
+        if self.resolved is not None:
+            return 'SymbolicLocation(%s)' % self.resolved
+        return str_impl(self, ['value', 'op'])
 
     def __add__(self, other):
         return SymbolicLocation(self, ('add', other))
@@ -50,30 +62,52 @@ class SymbolicLocation(DefaultRepr):
         return SymbolicLocation(self, ('add', other))
 
     def __rsub__(self, other):
-        return SymbolicLocation(self, ('sub', other * -1))
+        return SymbolicLocation(self, ('rsub', other))
 
     def __rmul__(self, other):
         return SymbolicLocation(self, ('mul', other))
 
+def resolve(value):
+    if type(value) == SymbolicLocation:
+        return value.resolve()
+    return value
+
 # from http://clarkupdike.blogspot.com/2009/01/canonical-python-str-method.html
 def str_impl(anInstance, displayAttributeList):
     classLine = "%s(" % (anInstance.__class__.__name__)
     return (classLine + ", ".join(["%s: %s" % (key, anInstance.__dict__[key]) for key in displayAttributeList])) + ")"
 
+# Every op starts and ends with the pointer on the same cell, and all of its
+# offsets are relative to that cell. An op that needs scratch cells declares
+# work_size and receives that many bound SymbolicLocations in get_children;
+# it must leave them zeroed, since the Lowerer hands them to the next op.
+
 class Op(DefaultRepr):
 
-    def __init__(self):
-        self.work_size = 0
+    work_size = 0
 
     def get_work_size(self):
         return self.work_size
 
+    def shape(self):
+        # the resolved parameters, which are all that determines the op's
+        # expansion apart from its work cells
+        return (type(self).__name__,) + tuple(
+            shape_of(self.__dict__[key]) for key in sorted(self.__dict__))
+
+def shape_of(value):
+    if isinstance(value, Op):
+        return value.shape()
+    elif type(value) in (list, tuple):
+        return tuple(shape_of(v) for v in value)
+    return resolve(value)
+
 class Literal(Op):
 
     def __init__(self, bf):
         self.bf = bf
 
-    def get_children(self):
+    def get_children(self, work):
         return []
 
 class Go(Op):
@@ -81,22 +115,34 @@ class Go(Op):
     def __init__(self, dst):
         self.dst = dst
 
-    def get_children(self):
-        if type(self.dst) == SymbolicLocation:
-            if self.dst.value is None:
-                raise Exception('Malformed go opcode %s: dst cannot be a SymbolicLocation with no value' % self)
-            else:
-                dst = self.get_value()
-        else:
-            dst = self.dst
-
+    def get_children(self, work):
+        dst = resolve(self.dst)
         if dst < 0:
             return [Literal('<' * (dst * -1))]
         else:
             return [Literal('>' * dst)]
 
+class Add(Op):
+
+    def __init__(self, dst, count):
+        self.dst = dst
+        self.count = count
+
+    def get_children(self, work):
+        return [Go(self.dst), Literal(('-' if self.count < 0 else '+') * abs(self.count)), Go(self.dst * -1)]
+
+class Zero(Op):
+
+    def __init__(self, dst):
+        self.dst = dst
+
+    def get_children(self, work):
+        return [Go(self.dst), Literal('[-]'), Go(self.dst * -1)]
+
 class Copy(Op):
 
+    work_size = 1
+
     def __init__(self, dst, src):
         self.dst = dst
         self.src = src
@@ -116,15 +162,16 @@ class Copy(Op):
         return code
 
 class Cond(Op):
+    # ops run with the pointer on src, so their offsets are relative to it
 
     def __init__(self, src, ops):
         self.src = src
         self.ops = ops
 
     def get_children(self, work):
-        code = [Go(src)]
+        code = [Go(self.src)]
         code += [Literal('[')]
-        code += ops
+        code += self.ops
         code += [Zero(0)]
         code += [Literal(']')]
         code += [Go(self.src * -1)]
@@ -132,65 +179,59 @@ class Cond(Op):
 
 class MoveBase(Op):
 
-    def __init__(self, src, dst):
-        self.src = src
+    def __init__(self, dst, src):
         self.dst = dst
+        self.src = src
 
     def get_children(self, work):
-        code = [Go(src)]
+        code = [Go(self.src)]
         code += [Literal('[-')]
         code += [Go(self.dst - self.src)]
-        code += [self.op]
+        code += [Literal(self.op)]
         code += [Go(self.src - self.dst)]
-        code += [']']
+        code += [Literal(']')]
         code += [Go(self.src * -1)]
         return code
 
 class Move(MoveBase):
-
-    def __init__(self, src, dst):
-        super().__init__(src, dst)
-        self.op = '+'
+    op = '+'
 
 class Unmove(MoveBase):
-
-    def __init__(self, src, dst):
-        super().__init__(src, dst)
-        self.op = '-'
+    op = '-'
 
 class IsZero(Op):
 
-    def __init__(self, src, dst, negated=False):
-        self.src = src
+    def __init__(self, dst, src, negated=False):
         self.dst = dst
+        self.src = src
         self.negated = negated
 
     def get_children(self, work):
         code = []
         if not self.negated:
-            code += [Add(dst, 1)]
+            code += [Add(self.dst, 1)]
 
-        code += [Cond(self.src, Add(self.dst - self.src, 1 if self.negated else -1))]
+        code += [Cond(self.src, [Add(self.dst - self.src, 1 if self.negated else -1)])]
         return code
 
 class And(Op):
 
+    work_size = 1
+
     def __init__(self, dst, src_list):
         self.dst = dst
         self.src_list = src_list
-        self.work_size = 1
 
-    def get_children(self):
+    def get_children(self, work):
         if len(self.src_list) == 0:
             raise Exception('Opcode \'and\' must have at least one src cell')
 
-        work = SymbolicLocation()
-        code = [Add(work, len(self.src_list))]
+        code = [Add(work[0], len(self.src_list))]
 
         for src in self.src_list:
-            code += [Cond(src, [Add(work - src, -1)])]
+            code += [Cond(src, [Add(work[0] - src, -1)])]
 
-        code += [IsZero(self.dst, work)]
+        code += [IsZero(self.dst, work[0])]
         return code
 
 class Or(Op):
@@ -205,14 +246,18 @@ class Or(Op):
 
         code = []
         for src in self.src_list:
-            code += [Cond(src, Add(self.dst - src, 1))]
+            code += [Cond(src, [Add(self.dst - src, 1)])]
         return code
 
 class Xor(Op):
+    # work[0] counts the nonzero sources, then dst is toggled once per count
+    # using work[1] as the toggle's scratch cell
 
-    def __init__(self, dst, src):
+    work_size = 2
+
+    def __init__(self, dst, src_list):
         self.dst = dst
-        self.src = src
+        self.src_list = src_list
 
     def get_children(self, work):
         if len(self.src_list) < 2:
@@ -220,28 +265,131 @@ class Xor(Op):
 
         code = []
         for src in self.src_list:
-            code += [Cond(src, Add(self.dst - src, 1))]
+            code += [Cond(src, [Add(work[0] - src, 1)])]
 
-        code += [self.visit(('copy', work[0], self.dst, work[1]))]
-        code += [self.visit(('iszero', work[0], work[1]))]
-        #code += [self.visit((
+        count, flag, dst = work[0], work[1] - work[0], self.dst - work[0]
+        code += [Go(count)]
+        code += [Literal('[-')]
+        code += [Add(flag, 1)]
+        code += [Cond(dst, [Add(flag - dst, -1)])]
+        code += [Move(dst, flag)]
+        code += [Literal(']')]
+        code += [Go(count * -1)]
         return code
 
-class Add(Op):
 
-    def __init__(self, dst, count):
-        self.dst = dst
-        self.count = count
+class ScratchPool(object):
+    # scratch cells at or above base, in the Lowerer's root coordinates. The
+    # lowest free cell is always handed out first, so sibling ops reuse the
+    # same cells once the earlier one releases them.
 
-    def get_children(self):
-        return [Go(self.dst)] + [('-' if self.count < 0 else '+') * abs(self.count)] + [Go(self.dst * -1)]
+    def __init__(self, base):
+        self.base = base
+        self.free = []
+        self.next = base
 
-def dump_ops(ops, depth=0):
-    for op in ops:
+    def allocate(self):
+        if self.free:
+            self.free.sort()
+            return self.free.pop(0)
+        cell = self.next
+        self.next += 1
+        return cell
+
+    def release(self, cell):
+        self.free.append(cell)
+
+    def is_free(self, cell):
+        return cell >= self.next or cell in self.free
+
+    def high_water(self):
+        return self.next
+
+
+class Expansion(object):
+    # an op lowered to BF; scratch is the set of scratch cells (relative to
+    # the op's own pointer position) used anywhere inside it
+
+    def __init__(self, op, children, bf, scratch):
+        self.op = op
+        self.children = children
+        self.bf = bf
+        self.scratch = scratch
+
+
+class Lowerer(object):
+    # expands ops down to Literals, allocating work cells from a ScratchPool
+    # that starts at scratch_base (e.g. just above the stack frame) and
+    # caching the expansion of every (op shape, work cells) seen
+
+    def __init__(self, scratch_base):
+        self.pool = ScratchPool(scratch_base)
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lower(self, ops):
+        return self.lowerList(ops, 0)
+
+    def emit(self, ops):
+        return ''.join(e.bf for e in self.lower(ops))
+
+    def lowerList(self, ops, base):
+        # base is the pointer's offset from the root, which moves as Go ops
+        # are passed over
+        expansions = []
+        for op in ops:
+            expansions.append(self.lowerOp(op, base))
+            if type(op) == Go:
+                base += resolve(op.dst)
+        return expansions
+
+    def lowerOp(self, op, base):
+        if type(op) == Literal:
+            return Expansion(op, [], op.bf, frozenset())
+
+        cells = [self.pool.allocate() for _ in range(op.get_work_size())]
+        try:
+            key = (op.shape(), tuple(cell - base for cell in cells))
+            cached = self.cache.get(key)
+            if cached is not None \
+            and all(self.pool.is_free(base + cell) for cell in cached.scratch - set(key[1])):
+                self.hits += 1
+                return cached
+
+            self.misses += 1
+            work = [SymbolicLocation() for _ in cells]
+            for location, cell in zip(work, cells):
+                location.bind(cell - base)
+
+            child_ops = op.get_children(work)
+            children = self.lowerList(child_ops, base)
+            bf = ''.join(child.bf for child in children)
+            scratch = set(key[1])
+            offset = 0
+            for child, child_op in zip(children, child_ops):
+                scratch.update(cell + offset for cell in child.scratch)
+                if type(child_op) == Go:
+                    offset += resolve(child_op.dst)
+
+            expansion = Expansion(op, children, bf, frozenset(scratch))
+            self.cache[key] = expansion
+            return expansion
+        finally:
+            for cell in reversed(cells):
+                self.pool.release(cell)
+
+def dump_ops(ops, lowerer, depth=0):
+    # prints the same expansions that Lowerer.emit turns into BF; the lowerer
+    # decides where the work cells go, so it has to be given one whose
+    # scratch_base is clear of every cell the ops use
+    dump_expansions(lowerer.lower(ops), depth)
+
+def dump_expansions(expansions, depth=0):
+    for e in expansions:
         print(' ' * (depth*2), end='')
-        if type(op) == str:
-            print('"%s"' % op)
+        if type(e.op) == Literal:
+            print('"%s"' % e.op.bf)
         else:
-            print(op)
-            children = op.get_children()
-            dump_ops(children, depth+1)
\ No newline at end of file
+            print(e.op)
+            dump_expansions(e.children, depth+1)